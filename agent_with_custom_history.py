@@ -1,11 +1,15 @@
 import asyncio
 import os
+import sys
+import weakref
 from dotenv import load_dotenv
 
 from typing import List, Optional
 from pydantic import BaseModel, Field, SecretStr
 import json
 
+import tiktoken
+from cachetools import LRUCache, TTLCache
 from langchain.callbacks.base import AsyncCallbackHandler
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.chat_history import BaseChatMessageHistory
@@ -37,37 +41,64 @@ async def final_answer(answer: str, tools_used: Optional[list[str]] = None) -> d
     """Use this tool to provide a final answer to the user."""
     return {"answer": answer, "tools_used": tools_used or []}
 
-tools = [add, subtract, multiply, exponentiate, final_answer, retrieval_tool, evaluate_expression]
-name2tool = {tool.name: tool.coroutine for tool in tools}
+# Interned so the per-token checks below can compare by identity
+FINAL_ANSWER_NAME = sys.intern(final_answer.name)
+
+# Sorted by name so the serialized tool schema is byte-identical across runs
+tools = sorted(
+    [add, subtract, multiply, exponentiate, final_answer, retrieval_tool, evaluate_expression],
+    key=lambda t: t.name
+)
+name2tool = {tool.name: tool.coroutine for tool in tools if tool.coroutine is not None}
+# Pure synchronous tools (the basic math ops) are called directly, skipping the coroutine hop
+name2tool_sync = {tool.name: tool.func for tool in tools if tool.coroutine is None}
 
 # ==== ConversationSummaryBufferMessageHistory ====
 
+TOKEN_BUDGET = 8_000  # max tokens kept verbatim in history before older turns are summarized
+ENCODING = tiktoken.encoding_for_model("gpt-4o-mini")
+
+def count_tokens(msg: BaseMessage) -> int:
+    """Return the token count of a message, computed once and stamped on the message."""
+    if "_tokens" not in msg.additional_kwargs:
+        msg.additional_kwargs["_tokens"] = len(ENCODING.encode(str(msg.content)))
+    return msg.additional_kwargs["_tokens"]
+
 class ConversationSummaryBufferMessageHistory(BaseChatMessageHistory, BaseModel):
     messages: List[BaseMessage] = Field(default_factory=list)
+    # Summary of the evicted turns, rendered just ahead of `messages`
+    summary: SystemMessage | None = None
     llm: ChatOpenAI
+    summarizer_llm: ChatOpenAI
     k: int
+    token_budget: int = TOKEN_BUDGET
 
-    def __init__(self, llm: ChatOpenAI, k: int, **kwargs):
-        super().__init__(llm=llm, k=k, **kwargs)
-
-    def add_messages(self, messages: List[BaseMessage]) -> None:
-        """Add messages to the history, summarizing anything beyond k messages."""
-        existing_summary: SystemMessage | None = None
-        old_messages: List[BaseMessage] | None = None
+    def __init__(self, llm: ChatOpenAI, k: int, summarizer_llm: Optional[ChatOpenAI] = None, **kwargs):
+        super().__init__(llm=llm, k=k, summarizer_llm=summarizer_llm or SUMMARIZER_LLM, **kwargs)
 
-        if len(self.messages) > 0 and isinstance(self.messages[0], SystemMessage):
-            existing_summary = self.messages.pop(0)
+    def _evict(self, messages: List[BaseMessage]) -> list[BaseMessage] | None:
+        """Append messages and, once they exceed k messages or the token budget, evict the
+        oldest down to half of both limits and return the summarization prompt for them."""
+        existing_summary: SystemMessage | None = self.summary
 
         self.messages.extend(messages)
-        old_messages = None
-
-        if len(self.messages) > self.k:
-            num_to_drop = len(self.messages) - self.k
-            old_messages = self.messages[:num_to_drop]
-            self.messages = self.messages[-self.k:]
-
-        if old_messages is None:
-            return
+        total_tokens = sum(count_tokens(msg) for msg in self.messages)
+        if len(self.messages) <= self.k and total_tokens <= self.token_budget:
+            return None
+
+        # Compact in one block rather than a few messages per turn, so between compactions
+        # the summary and history only grow and stay a byte-stable prompt prefix
+        keep_messages = self.k // 2
+        keep_tokens = self.token_budget // 2
+        num_to_drop = 0
+        while num_to_drop < len(self.messages) and (
+            len(self.messages) - num_to_drop > keep_messages or total_tokens > keep_tokens
+        ):
+            total_tokens -= count_tokens(self.messages[num_to_drop])
+            num_to_drop += 1
+
+        old_messages = self.messages[:num_to_drop]
+        self.messages = self.messages[num_to_drop:]
 
         summary_prompt = ChatPromptTemplate.from_messages([
             SystemMessagePromptTemplate.from_template(
@@ -82,17 +113,30 @@ class ConversationSummaryBufferMessageHistory(BaseChatMessageHistory, BaseModel)
 
         existing_summary_text = existing_summary.content if existing_summary else ""
         old_messages_text = "\n".join([msg.content for msg in old_messages])
-        summary_messages = summary_prompt.format_messages(
+        return summary_prompt.format_messages(
             existing_summary=existing_summary_text,
             old_messages=old_messages_text
         )
 
-        # Call LLM to get summary (sync here; adapt if you want async)
-        new_summary = self.llm.invoke(summary_messages)
-        self.messages = [SystemMessage(content=new_summary.content)] + self.messages
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        """Add messages to the history, summarizing anything beyond k messages."""
+        summary_messages = self._evict(messages)
+        if summary_messages is None:
+            return
+        new_summary = self.summarizer_llm.invoke(summary_messages)
+        self.summary = SystemMessage(content=new_summary.content)
+
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        """Async variant of add_messages; awaits the summary so the event loop is not blocked."""
+        summary_messages = self._evict(messages)
+        if summary_messages is None:
+            return
+        new_summary = await self.summarizer_llm.ainvoke(summary_messages)
+        self.summary = SystemMessage(content=new_summary.content)
 
     def clear(self) -> None:
         self.messages = []
+        self.summary = None
 
 # ==== LLM and prompt ====
 
@@ -103,8 +147,18 @@ llm = ChatOpenAI(
     api_key=OPENAI_API_KEY
 )
 
+# Summaries are awaited whole, so streaming buys nothing; cap the output length too
+SUMMARIZER_LLM = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0.0,
+    streaming=False,
+    max_tokens=512,
+    api_key=OPENAI_API_KEY
+)
+
 prompt = ChatPromptTemplate.from_messages([
-    ("system", (
+    # A literal SystemMessage is passed through as-is instead of being re-rendered as a template
+    SystemMessage(content=(
         "You're a helpful assistant. You have access to several tools: "
         "math functions including basic operation (add, subtract, multiply, and exp) tools based on natural language"
         "and a complex expression evaluation tool,"
@@ -122,48 +176,110 @@ prompt = ChatPromptTemplate.from_messages([
         "If nothing is found after one attempt, use your own knowledge to answer the user's question via `final_answer`."
         "you MUST use the final_answer tool to provide a final answer."
     )),
+    # Layout is [static system] -> [summary] -> [committed history] -> [recent]. The summary
+    # and history only change at a compaction, so this head is eligible for OpenAI prefix caching.
+    MessagesPlaceholder(variable_name="summary", optional=True),
     MessagesPlaceholder(variable_name="chat_history"),
     ("human", "{input}"),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
+    MessagesPlaceholder(variable_name="agent_scratchpad", optional=True),
 ])
 
+# Built once at import time: binding the tools serializes their JSON schema,
+# and reusing the same runnable keeps that block stable for prefix caching.
+BOUND_AGENT = prompt | llm.bind_tools(tools, tool_choice="any")
+
 # ==== Streaming Handler ====
 
 class QueueCallbackHandler(AsyncCallbackHandler):
+    # Singleton sentinels put on the queue between chunks; consumers test them with `is`
+    STEP_END = object()
+    DONE = object()
+
     def __init__(self, queue: asyncio.Queue):
         self.queue = queue
         self.final_answer_seen = False
 
     async def __aiter__(self):
         while True:
-            if self.queue.empty():
-                await asyncio.sleep(0.1)
-                continue
             token_or_done = await self.queue.get()
-            if token_or_done == "<<DONE>>":
+            if token_or_done is self.DONE:
                 return
             if token_or_done:
                 yield token_or_done
 
     async def on_llm_new_token(self, *args, **kwargs) -> None:
         chunk = kwargs.get("chunk")
-        if chunk and chunk.message.additional_kwargs.get("tool_calls"):
-            if chunk.message.additional_kwargs["tool_calls"][0]["function"]["name"] == "final_answer":
-                self.final_answer_seen = True
-        self.queue.put_nowait(kwargs.get("chunk"))
+        if chunk and not self.final_answer_seen:
+            addl = chunk.message.additional_kwargs
+            if tool_calls := addl.get("tool_calls"):
+                # Only the first chunk of a tool call carries its name
+                name = tool_calls[0]["function"].get("name")
+                if name and sys.intern(name) is FINAL_ANSWER_NAME:
+                    self.final_answer_seen = True
+        self.queue.put_nowait(chunk)
 
     async def on_llm_end(self, *args, **kwargs) -> None:
         if self.final_answer_seen:
-            self.queue.put_nowait("<<DONE>>")
+            self.queue.put_nowait(self.DONE)
         else:
-            self.queue.put_nowait("<<STEP_END>>")
+            self.queue.put_nowait(self.STEP_END)
+
+# ==== Tool call deduplication ====
+
+# Tools whose output depends only on their arguments, so identical calls can share one result
+DEDUP_TOOLS = {retrieval_tool.name}
+# (tool_name, serialized args) -> task of the call currently running for that key
+INFLIGHT: dict[tuple[str, str], asyncio.Task] = {}
+# Short-lived reuse of finished results across sessions and retries
+TOOL_RESULT_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=30)
+# Sentinel for cache misses, since a tool may legitimately return None
+_MISSING = object()
+
+async def call_tool_deduped(tool_name: str, tool_args: dict):
+    """Run a tool, sharing the in-flight call or a recent result for identical arguments."""
+    key = (tool_name, json.dumps(tool_args, sort_keys=True, default=str))
+    # One lookup: an entry can expire between a membership test and the read
+    cached = TOOL_RESULT_CACHE.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    task = INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(name2tool[tool_name](**tool_args))
+        INFLIGHT[key] = task
+
+        def on_done(t: asyncio.Task) -> None:
+            # A call that was still running when the store changed is neither tracked nor cached
+            if INFLIGHT.get(key) is not t:
+                return
+            del INFLIGHT[key]
+            if not t.cancelled() and t.exception() is None:
+                TOOL_RESULT_CACHE[key] = t.result()
+
+        task.add_done_callback(on_done)
+    # Shield so one caller being cancelled does not cancel the call other callers await
+    return await asyncio.shield(task)
+
+def invalidate_tool_results() -> None:
+    """
+    Forget cached and in-flight tool results, so calls made after the docs or
+    the vectorstore change do not get answers from before the change.
+    Must be called from the event loop thread.
+    """
+    TOOL_RESULT_CACHE.clear()
+    INFLIGHT.clear()
 
 async def execute_tool(tool_call: AIMessage, selected_source=None) -> ToolMessage:
     tool_name = tool_call.tool_calls[0]["name"]
     tool_args = tool_call.tool_calls[0]["args"]
     if tool_name == "retrieval_tool" and selected_source:
         tool_args["source"] = selected_source
-    tool_out = await name2tool[tool_name](**tool_args)
+    sync_fn = name2tool_sync.get(tool_name)
+    if sync_fn:
+        tool_out = sync_fn(**tool_args)
+    elif tool_name in DEDUP_TOOLS:
+        tool_out = await call_tool_deduped(tool_name, tool_args)
+    else:
+        tool_out = await name2tool[tool_name](**tool_args)
     return ToolMessage(
         content=f"{tool_out}",
         tool_call_id=tool_call.tool_calls[0]["id"]
@@ -172,21 +288,15 @@ async def execute_tool(tool_call: AIMessage, selected_source=None) -> ToolMessag
 # ==== Agent Executor ====
 
 class CustomAgentExecutor:
-    def __init__(self, max_iterations: int = 3, k: int = 6):
-        # session_id -> ConversationSummaryBufferMessageHistory
-        self.memory_map: dict[str, ConversationSummaryBufferMessageHistory] = {}
+    def __init__(self, max_iterations: int = 3, k: int = 6, max_sessions: int = 10_000):
+        # session_id -> ConversationSummaryBufferMessageHistory, least recently used sessions evicted first
+        self.memory_map: LRUCache[str, ConversationSummaryBufferMessageHistory] = LRUCache(maxsize=max_sessions)
         self.max_iterations = max_iterations
         self.k = k
         self.llm = llm
-        self.agent = (
-            {
-                "input": lambda x: x["input"],
-                "chat_history": lambda x: x["chat_history"],
-                "agent_scratchpad": lambda x: x.get("agent_scratchpad", [])
-            }
-            | prompt
-            | self.llm.bind_tools(tools, tool_choice="any")
-        )
+        self.agent = BOUND_AGENT
+        # session_id -> lock serializing that session's turns; entries vanish once no turn holds them
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
 
     def get_memory(self, session_id: str) -> ConversationSummaryBufferMessageHistory:
         if session_id not in self.memory_map:
@@ -198,54 +308,81 @@ class CustomAgentExecutor:
     def print_chat_history(self, session_id: str):
         memory = self.get_memory(session_id)
         logging.info(f"\n===== Chat History for session '{session_id}' =====")
+        if memory.summary:
+            logging.info(f"# ~~ summary:\n{memory.summary.content}")
         for msg in memory.messages:
-            if isinstance(msg, SystemMessage):
-                logging.info(f"# ~~ summary:\n{msg.content}")
-            elif isinstance(msg, HumanMessage):
+            if isinstance(msg, HumanMessage):
                 logging.info(f"Human: {msg.content}")
             elif isinstance(msg, AIMessage):
                 logging.info(f"AI: {msg.content}")
         logging.info("==============================================\n")
 
+    def get_lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
     async def invoke(self, input: str, streamer: QueueCallbackHandler, session_id: str, selected_source: Optional[str] = None, verbose: bool = False) -> dict:
+        # Concurrent turns for the same session would read and rewrite the same history,
+        # so serialize them; different sessions still run in parallel.
+        async with self.get_lock(session_id):
+            return await self._invoke(input, streamer, session_id, selected_source, verbose)
+
+    async def _invoke(self, input: str, streamer: QueueCallbackHandler, session_id: str, selected_source: Optional[str] = None, verbose: bool = False) -> dict:
         memory = self.get_memory(session_id)
         chat_history = memory.messages
+        summary = [memory.summary] if memory.summary else []
         count = 0
         final_answer: str | None = None
         final_answer_call: dict | None = None
         agent_scratchpad: list[AIMessage | ToolMessage] = []
 
-        async def stream(query: str) -> list[AIMessage]:
+        async def stream(query: str) -> tuple[list[AIMessage], list[asyncio.Task]]:
             response = self.agent.with_config(
                 callbacks=[streamer]
             )
             outputs = []
+            messages: list[AIMessage] = []
+            pending_tool_tasks: list[asyncio.Task] = []
+
+            def dispatch(chunk) -> None:
+                # A tool call's args are complete once the next call starts or the stream ends,
+                # so start executing it right away instead of waiting for the whole turn.
+                message = AIMessage(
+                    content=chunk.content,
+                    tool_calls=chunk.tool_calls,
+                    tool_call_id=chunk.tool_calls[0]["id"]
+                )
+                messages.append(message)
+                pending_tool_tasks.append(asyncio.create_task(
+                    execute_tool(message, selected_source=selected_source)
+                ))
+
             async for token in response.astream({
                 "input": query,
                 "chat_history": chat_history,
+                "summary": summary,
                 "agent_scratchpad": agent_scratchpad
             }):
                 tool_calls = token.additional_kwargs.get("tool_calls")
                 if tool_calls:
                     if tool_calls[0]["id"]:
+                        if outputs:
+                            dispatch(outputs[-1])
                         outputs.append(token)
                     else:
                         outputs[-1] += token
                 else:
                     pass
-            return [
-                AIMessage(
-                    content=x.content,
-                    tool_calls=x.tool_calls,
-                    tool_call_id=x.tool_calls[0]["id"]
-                ) for x in outputs
-            ]
+            if outputs:
+                dispatch(outputs[-1])
+            return messages, pending_tool_tasks
 
         while count < self.max_iterations:
-            tool_calls = await stream(query=input)
-            tool_obs = await asyncio.gather(
-                *[execute_tool(tool_call, selected_source=selected_source) for tool_call in tool_calls]
-            )
+            tool_calls, pending_tool_tasks = await stream(query=input)
+            tool_obs = await asyncio.gather(*pending_tool_tasks)
             id2tool_obs = {tool_call.tool_call_id: tool_obs for tool_call, tool_obs in zip(tool_calls, tool_obs)}
             for tool_call in tool_calls:
                 agent_scratchpad.extend([
@@ -255,7 +392,7 @@ class CustomAgentExecutor:
             count += 1
             found_final_answer = False
             for tool_call in tool_calls:
-                if tool_call.tool_calls[0]["name"] == "final_answer":
+                if sys.intern(tool_call.tool_calls[0]["name"]) is FINAL_ANSWER_NAME:
                     final_answer_call = tool_call.tool_calls[0]
                     final_answer = final_answer_call["args"]["answer"]
                     found_final_answer = True
@@ -264,7 +401,7 @@ class CustomAgentExecutor:
                 break
 
         # Add the input and final output as messages and update summary if needed
-        memory.add_messages([
+        await memory.aadd_messages([
             HumanMessage(content=input),
             AIMessage(content=final_answer if final_answer else "No answer found")
         ])
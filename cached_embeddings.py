@@ -0,0 +1,41 @@
+# cached_embeddings.py
+
+import hashlib
+from typing import List
+from cachetools import LRUCache
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+QUERY_CACHE_SIZE = 4096 # Number of query embeddings kept in memory
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model and memoizes query embeddings in an in-process LRU,
+    so repeated questions skip the embeddings API round-trip.
+    Document embeddings are passed through unchanged.
+    """
+
+    def __init__(self, embeddings: OpenAIEmbeddings, maxsize: int = QUERY_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.cache: LRUCache[tuple[str, str], List[float]] = LRUCache(maxsize=maxsize)
+
+    def _key(self, text: str) -> tuple[str, str]:
+        return (self.embeddings.model, hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        if key not in self.cache:
+            self.cache[key] = self.embeddings.embed_query(text)
+        return self.cache[key]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        if key not in self.cache:
+            self.cache[key] = await self.embeddings.aembed_query(text)
+        return self.cache[key]
@@ -1,18 +1,34 @@
+import io
 import os
+import shutil
+from typing import BinaryIO
 
 DOCS_DIR = "docs"
+COPY_BUFFER_SIZE = 1 << 20  # 1 MiB per read/write when streaming uploads to disk
 
-def upload_doc(filename: str, file_content: bytes) -> str:
-    """
-    Saves the uploaded markdown file to the docs/ directory.
-    Overwrites if file exists.
-    Returns the path to the saved file.
-    """
+def _doc_path(filename: str) -> str:
     # Sanitize filename (simple: no path traversal)
     if "/" in filename or "\\" in filename or filename.startswith("."):
         raise ValueError("Invalid filename.")
     os.makedirs(DOCS_DIR, exist_ok=True)
-    path = os.path.join(DOCS_DIR, filename)
+    return os.path.join(DOCS_DIR, filename)
+
+def upload_doc_stream(filename: str, file_obj: BinaryIO) -> str:
+    """
+    Streams the uploaded markdown file to the docs/ directory in fixed-size chunks,
+    so memory use stays constant regardless of file size.
+    Overwrites if file exists.
+    Returns the path to the saved file.
+    """
+    path = _doc_path(filename)
     with open(path, "wb") as f:
-        f.write(file_content)
+        shutil.copyfileobj(file_obj, f, length=COPY_BUFFER_SIZE)
     return path
+
+def upload_doc(filename: str, file_content: bytes) -> str:
+    """
+    Saves the uploaded markdown file to the docs/ directory.
+    Overwrites if file exists.
+    Returns the path to the saved file.
+    """
+    return upload_doc_stream(filename, io.BytesIO(file_content))
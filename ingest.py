@@ -2,6 +2,9 @@
 
 import os
 import glob
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 # ─── Step 1: Imports ────────────────────────────────────────────────────────────
@@ -25,12 +28,94 @@ if not openai_key:
 
 DOCS_DIR = "docs"         # directory containing Markdown files
 CHROMA_DIR = "chroma_db"  # where Chroma persists embeddings
-EMBEDDING_MODEL = OpenAIEmbeddings()
+EMBEDDING_MODEL = OpenAIEmbeddings(chunk_size=1_000)  # texts per embeddings API request
+EMBED_BATCH_SIZE = 512  # chunks embedded and written to Chroma per round-trip
 
 # We will split on Markdown headers first, then enforce a character cap
 CHUNK_SIZE = 1_000     # max 1,000 characters per chunk
 CHUNK_OVERLAP = 100    # overlap 100 characters to preserve continuity
 
+# Stage 1 cuts each file into header-delimited sections (headers kept in the text and
+# recorded as h1/h2/h3 metadata); stage 2 only splits sections that exceed CHUNK_SIZE.
+HEADER_SPLITTER = MarkdownHeaderTextSplitter(
+    headers_to_split_on=[("#", "h1"), ("##", "h2"), ("###", "h3")],
+    strip_headers=False,
+)
+CHAR_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
+
+
+# Hashed along with each file, so changing how files are split re-ingests them too
+SPLIT_SETTINGS = f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:".encode()
+
+
+def file_sha256(path: str) -> str:
+    """Hash the raw bytes of a file so unchanged files can be skipped on re-ingest."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(SPLIT_SETTINGS + f.read()).hexdigest()
+
+
+def doc_source(path: str) -> str:
+    """Source label of a file: its path under DOCS_DIR, so same-named files in subfolders stay apart."""
+    return os.path.relpath(path, DOCS_DIR)
+
+
+def chunk_id(source: str, index: int, content: str) -> str:
+    """Stable chunk ID: re-ingesting the same chunk upserts it instead of duplicating it."""
+    return hashlib.sha256(f"{source}:{index}:{content}".encode()).hexdigest()
+
+
+def delete_stale(vectorstore: Chroma, sources: list[str], keep_ids: set[str]) -> None:
+    """Delete the stored chunks of `sources` that are not in keep_ids, i.e. that a new split no longer produces."""
+    stored = vectorstore.get(where={"source": {"$in": sources}}, include=[])["ids"]
+    stale = [i for i in stored if i not in keep_ids]
+    # Delete in slices: one call with every id can exceed SQLite's bound-variable limit
+    delete_size = vectorstore._client.get_max_batch_size()
+    for i in range(0, len(stale), delete_size):
+        vectorstore._collection.delete(ids=stale[i:i + delete_size])
+
+
+def load_and_split(path: str, file_hash: str) -> list[Document]:
+    """
+    Load a single Markdown file and split it into labelled chunks.
+    Lives at module scope so it can be pickled into worker processes.
+    """
+    try:
+        loader = TextLoader(path, encoding="utf-8")
+        docs_from_file = loader.load()  # returns [Document(page_content=...)]
+    except Exception as e:
+        print(f"Error loading file {path}: {e}")
+        return []
+    for doc in docs_from_file:
+        doc.metadata["source"] = doc_source(path)
+
+    sections: list[Document] = []
+    for raw_doc in docs_from_file:
+        for section in HEADER_SPLITTER.split_text(raw_doc.page_content):
+            section.metadata.update(raw_doc.metadata)
+            sections.append(section)
+    # split_documents copies each section's metadata (including source) onto its chunks
+    chunks = CHAR_SPLITTER.split_documents(sections)
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["file_hash"] = file_hash
+        chunk.metadata["chunk_count"] = len(chunks)
+        chunk.id = chunk_id(chunk.metadata["source"], i, chunk.page_content)
+    return chunks
+
+
+def is_stored(vectorstore: Chroma, source: str, file_hash: str) -> bool:
+    """
+    True if every stored chunk of `source` belongs to this version of the file
+    and all of them were written, so an interrupted ingest is picked up again.
+    """
+    stored = vectorstore.get(where={"source": source}, include=["metadatas"])["metadatas"]
+    return bool(stored) and all(
+        md.get("file_hash") == file_hash and md.get("chunk_count") == len(stored)
+        for md in stored
+    )
+
 
 def main():
     # ─── Step 4: Find all .md files under docs/ ────────────────────────────────
@@ -39,47 +124,63 @@ def main():
         print(f"No Markdown files found in '{DOCS_DIR}/'.")
         return
 
-    # ─── Step 5: Load each Markdown file as a single Document ───────────────────
-    raw_documents: list[Document] = []
+    vectorstore = Chroma(
+        persist_directory=CHROMA_DIR,
+        embedding_function=EMBEDDING_MODEL
+    )
+
+    # ─── Step 5: Skip files whose content is already stored ──────────────────────
+    changed_paths: list[str] = []
+    changed_hashes: list[str] = []
     for path in md_paths:
         try:
-            loader = TextLoader(path, encoding="utf-8")
-            docs_from_file = loader.load()  # returns [Document(page_content=...)]
-            for doc in docs_from_file:
-                doc.metadata["source"] = os.path.basename(path)
-            raw_documents.extend(docs_from_file)
-        except Exception as e:
+            file_hash = file_sha256(path)
+        except OSError as e:
             print(f"Error loading file {path}: {e}")
-
-    print(f"✅ Loaded {len(raw_documents)} document(s).")
-
-    # ─── Step 6: Split each document using RecursiveCharacterTextSplitter ────────
-    # We list header‐style separators first, so it splits on ##, ###, etc., before falling back to newline.
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n### ", "\n## ", "\n# ", "\n"],
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-    )
-
-    split_docs = []
-    for raw_doc in raw_documents:
-        chunks = text_splitter.split_documents([raw_doc])
-        # Ensure source metadata is copied to all split chunks
-        for chunk in chunks:
-            if "source" not in chunk.metadata:
-                chunk.metadata["source"] = raw_doc.metadata["source"]
-        split_docs.extend(chunks)
+            continue
+        if is_stored(vectorstore, doc_source(path), file_hash):
+            continue
+        changed_paths.append(path)
+        changed_hashes.append(file_hash)
+
+    print(f"✅ {len(changed_paths)} of {len(md_paths)} file(s) new or changed.")
+
+    # ─── Step 6: Load & split files in parallel ──────────────────────────────────
+    # Splitting is CPU-bound pure Python, so use processes rather than threads to sidestep the GIL.
+    split_docs: list[Document] = []
+    # (source, ids of its new chunks, end of its chunks in split_docs) for each file that loaded
+    file_ends: deque[tuple[str, set[str], int]] = deque()
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(load_and_split, changed_paths, changed_hashes, chunksize=4)
+        for path, chunks in zip(changed_paths, results):
+            if not chunks:
+                # Nothing loaded: keep whatever is stored for this file
+                continue
+            split_docs.extend(chunks)
+            file_ends.append((doc_source(path), {d.id for d in chunks}, len(split_docs)))
 
     print(f"✅ Split into {len(split_docs)} chunks.")
     if split_docs:
         print("Sample chunk metadata:", split_docs[0].metadata)
 
     # ─── Step 7: Embed & Persist to Chroma ───────────────────────────────────────
-    vectorstore = Chroma.from_documents(
-        documents=split_docs,
-        embedding=EMBEDDING_MODEL,
-        persist_directory=CHROMA_DIR
-    )
+    # Embed explicitly in large batches so each API request carries many texts,
+    # then hand the precomputed vectors straight to the collection.
+    for i in range(0, len(split_docs), EMBED_BATCH_SIZE):
+        batch = split_docs[i:i + EMBED_BATCH_SIZE]
+        texts = [d.page_content for d in batch]
+        metadatas = [d.metadata for d in batch]
+        embeddings = EMBEDDING_MODEL.embed_documents(texts)
+        vectorstore._collection.upsert(
+            ids=[d.id for d in batch],
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas
+        )
+        # Once all of a file's new chunks are written, drop those left over from its previous version
+        while file_ends and file_ends[0][2] <= i + len(batch):
+            source, ids, _ = file_ends.popleft()
+            delete_stale(vectorstore, [source], ids)
     print(f"✅ Chroma DB persisted to {CHROMA_DIR}.")
 
 
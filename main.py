@@ -1,6 +1,9 @@
 import asyncio
 import json
 import os
+import itertools
+
+import orjson
 
 from fastapi import FastAPI, HTTPException, status, UploadFile, File, Body
 from fastapi.responses import StreamingResponse
@@ -12,10 +15,13 @@ from pydantic import BaseModel
 
 # agent imports
 # from agent import QueueCallbackHandler, agent_executor
-from agent_with_custom_history import QueueCallbackHandler, agent_executor
+from agent_with_custom_history import QueueCallbackHandler, agent_executor, invalidate_tool_results
+
+# tool imports
+from tools.search_tools import close_session
 
 # doc and rag manager imports
-from doc_manager import upload_doc
+from doc_manager import upload_doc_stream
 from rag_manager import ingest_all, ingest, delete_docs, summarize_chroma
 
 # Log management
@@ -34,6 +40,10 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.on_event("shutdown")
+async def shutdown():
+    await close_session()
+
 class InvokeRequest(BaseModel):
     content: str
     session_id: str
@@ -49,13 +59,13 @@ async def token_generator(content: str, streamer: QueueCallbackHandler, session_
     ))
     async for token in streamer:
         try:
-            if token == "<<STEP_END>>":
-                yield "</step>"
+            if token is streamer.STEP_END:
+                yield b"</step>"
             elif tool_calls := token.message.additional_kwargs.get("tool_calls"):
                 if tool_name := tool_calls[0]["function"]["name"]:
-                    yield f"<step><step_name>{tool_name}</step_name>"
+                    yield f"<step><step_name>{tool_name}</step_name>".encode()
                 if tool_args := tool_calls[0]["function"]["arguments"]:
-                    yield tool_args
+                    yield tool_args.encode()
         except Exception as e:
             logging.error(f"Error streaming token: {e}")
             continue
@@ -68,16 +78,22 @@ async def token_generator(content: str, streamer: QueueCallbackHandler, session_
         result = agent_scratchpad[i+1] if i+1 < len(agent_scratchpad) else None
         if hasattr(call, "tool_calls") and call.tool_calls and result:
             tool_name = call.tool_calls[0]["name"]
+            # stdlib json keeps integers beyond 64 bits exact; orjson would turn them into floats
             try:
                 content = json.loads(result.content)
-            except Exception:
+            except (TypeError, ValueError):
                 content = result.content
             scratchpad_summary.append({
                 "name": tool_name,
                 "result": content,
             })
     # Yield the scratchpad as a final message
-    yield f"<scratchpad>{json.dumps(scratchpad_summary)}</scratchpad>"
+    try:
+        payload = orjson.dumps(scratchpad_summary)
+    except orjson.JSONEncodeError:
+        # orjson rejects integers beyond 64 bits, so fall back for such (rare) results
+        payload = json.dumps(scratchpad_summary).encode()
+    yield b"<scratchpad>" + payload + b"</scratchpad>"
 
 
 @app.post("/invoke")
@@ -94,20 +110,50 @@ async def invoke(request: InvokeRequest):
     )
 
 
+# Chunk counts per source, built from Chroma metadata on first use and
+# dropped whenever an endpoint changes the docs or the vectorstore.
+# Each entry is tagged with the generation it was scanned in; invalidating just
+# moves to a new generation, so it never waits on a scan in progress.
+_summary_generations = itertools.count()
+_summary_generation = next(_summary_generations)
+_summary_cache: tuple[int, dict[str, int]] | None = None
+
+def get_summary() -> dict[str, int]:
+    global _summary_cache
+    generation = _summary_generation
+    cached = _summary_cache
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    summary = {item['source']: item['count'] for item in summarize_chroma()}
+    # If the store changed during the scan, the entry's stale tag keeps it from being served
+    _summary_cache = (generation, summary)
+    return summary
+
+def invalidate_summary() -> None:
+    global _summary_generation
+    _summary_generation = next(_summary_generations)
+
+def invalidate_store_caches() -> None:
+    """Drop everything derived from the docs or the vectorstore after an endpoint changes them."""
+    invalidate_summary()
+    invalidate_tool_results()
+
 # RAG managing endpoint
 @app.get("/rag/summary")
 def api_rag_summary():
     return summarize_chroma()
 
 @app.post("/rag/ingest-all")
-def api_ingest_all():
-    ingest_all()
+async def api_ingest_all():
+    await ingest_all()
+    invalidate_store_caches()
     return {"message": "All docs ingested."}
 
 @app.post("/rag/ingest")
-def api_ingest(doc_names: list[str]):
+async def api_ingest(doc_names: list[str]):
     try:
-        num_chunks = ingest(doc_names)
+        num_chunks = await ingest(doc_names)
+        invalidate_store_caches()
     except FileNotFoundError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,8 +162,10 @@ def api_ingest(doc_names: list[str]):
     return {"message": f"Ingested: {doc_names}", "chunks_ingested": num_chunks}
 
 @app.delete("/rag/delete")
-def api_delete(doc_names: List[str]):
-    deleted_counts = delete_docs(doc_names)
+async def api_delete(doc_names: List[str]):
+    # Delete off the event loop, then invalidate on it: the tool-result cache is not thread-safe
+    deleted_counts = await asyncio.to_thread(delete_docs, doc_names)
+    invalidate_store_caches()
     not_found = [doc for doc, count in deleted_counts.items() if count == 0]
     if not_found:
         # If ANY doc was not found, return 404 and list which ones
@@ -135,26 +183,28 @@ async def upload_markdown(file: UploadFile = File(...)):
     # Only allow .md files
     if not file.filename.endswith(".md"):
         raise HTTPException(status_code=400, detail="Only .md files are allowed")
-    # Read file contents
-    content = await file.read()
+    # Stream the spooled upload to disk off the event loop instead of reading it into memory
     try:
-        path = upload_doc(file.filename, content)
+        path = await asyncio.to_thread(upload_doc_stream, file.filename, file.file)
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+    invalidate_store_caches()
     return {"message": f"File {file.filename} uploaded", "path": path}
 
 DOCS_DIR = "docs"
 
-@app.get("/rag/list")
-def rag_list():
-    # Step 1: List all .md files in docs/
-    files = [
+def _list_md_files() -> list[str]:
+    return [
         f for f in os.listdir(DOCS_DIR)
         if os.path.isfile(os.path.join(DOCS_DIR, f)) and f.endswith(".md")
     ]
-    # Step 2: Get Chroma summary (returns [{'source': filename, 'count': chunks}, ...])
-    chroma_summary = summarize_chroma()
-    chunk_map = {item['source']: item['count'] for item in chroma_summary}
+
+@app.get("/rag/list")
+async def rag_list():
+    # Step 1: List all .md files in docs/ (blocking filesystem calls run off the event loop)
+    files = await asyncio.to_thread(_list_md_files)
+    # Step 2: Get cached Chroma chunk counts ({filename: chunks}); only rescans after a change
+    chunk_map = await asyncio.to_thread(get_summary)
     # Step 3: Build the results list
     results = []
     for fname in files:
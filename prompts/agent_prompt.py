@@ -1,13 +1,16 @@
 # prompts/agent_prompt.py
 
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain_core.messages import SystemMessage
 
+# Static system text as a ready-made message, so it is not re-formatted on every invoke
 agent_prompt = ChatPromptTemplate.from_messages([
-    ("system",
-     "You are a helpful assistant that can call the `retrieval_tool` to fetch relevant document chunks.\n"
-     "When you need to look up information in our indexed documents, call `retrieval_tool(query)` with the exact user question.\n"
-     "Then use that output in your reasoning."),
+    SystemMessage(content=(
+        "You are a helpful assistant that can call the `retrieval_tool` to fetch relevant document chunks.\n"
+        "When you need to look up information in our indexed documents, call `retrieval_tool(query)` with the exact user question.\n"
+        "Then use that output in your reasoning."
+    )),
     MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "{input}"),
-    ("placeholder", "{agent_scratchpad}")
+    HumanMessagePromptTemplate.from_template("{input}"),
+    MessagesPlaceholder(variable_name="agent_scratchpad", optional=True),
 ])
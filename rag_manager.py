@@ -1,16 +1,30 @@
 import os
+import re
 import glob
+import asyncio
+import itertools
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import aiofiles
+import tiktoken
 from dotenv import load_dotenv
 
 from typing import List, Dict
 
-from langchain_community.document_loaders import TextLoader
 from langchain.schema import Document
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 
+# Same chunk ids and source labels as the ingest script, so both keep one copy of each chunk
+from ingest import chunk_id, delete_stale, doc_source
+
+# Log management
+import logging
+log = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 openai_key = os.getenv("OPENAI_API_KEY")
@@ -20,8 +34,35 @@ if not openai_key:
 DOCS_DIR = "docs"
 CHROMA_DIR = "chroma_db"
 EMBEDDING_MODEL = OpenAIEmbeddings()
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 100
+# Chunk sizes are measured in embedding-model tokens, not characters
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 40
+MIN_CHUNK_TOKENS = 100   # chunks smaller than this are merged into a neighbour...
+MAX_MERGED_TOKENS = 440  # ...as long as the merged chunk stays under this
+EMBED_BATCH_SIZE = 1000  # texts per embeddings request (OpenAI batch limit)
+EMBED_CONCURRENCY = 8    # embeddings requests in flight at once
+WRITE_BATCH_SIZE = 5000  # rows per Chroma add(), i.e. per SQLite transaction/fsync
+READ_CONCURRENCY = 64     # files open for reading at once
+SUMMARY_PAGE_SIZE = 10_000  # metadata rows fetched per page when counting chunks
+
+ENCODING = tiktoken.encoding_for_model(EMBEDDING_MODEL.model)
+TEXT_SPLITTER = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+    encoding_name=ENCODING.name,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    separators=["\n### ", "\n## ", "\n# ", "\n\n", "\n", " "],
+)
+# All line-level separators in one alternation, so a document is scanned once
+_SEP_RE = re.compile(r"(\n### |\n## |\n# |\n)")
+
+# One Chroma handle shared by summarize_chroma, ingest_all, ingest and delete_docs,
+# opened on first use so importing this module does not create CHROMA_DIR
+@lru_cache(maxsize=None)
+def get_vectorstore() -> Chroma:
+    return Chroma(
+        persist_directory=CHROMA_DIR,
+        embedding_function=EMBEDDING_MODEL
+    )
 
 # DB summary
 def summarize_chroma():
@@ -31,80 +72,246 @@ def summarize_chroma():
     Returns:
         List of dicts: [{ "source": <filename>, "count": <num_chunks> }, ...]
     """
-    vectorstore = Chroma(
-        persist_directory=CHROMA_DIR,
-        embedding_function=EMBEDDING_MODEL
-    )
-    # Get all metadata
-    all_metadatas = vectorstore.get(include=["metadatas"])["metadatas"]
-    # Count by source
-    from collections import Counter
-    sources = [md.get("source", "UNKNOWN") for md in all_metadatas]
-    counts = Counter(sources)
+    # Page through the metadata and count by source as we go, so peak memory
+    # is bounded by one page rather than the whole collection
+    counts = Counter()
+    vectorstore = get_vectorstore()
+    total = vectorstore._collection.count()
+    for offset in range(0, total, SUMMARY_PAGE_SIZE):
+        page = vectorstore.get(include=["metadatas"], limit=SUMMARY_PAGE_SIZE, offset=offset)
+        counts.update(md.get("source", "UNKNOWN") for md in page["metadatas"])
     summary = [{"source": src, "count": count} for src, count in counts.items()]
     return summary
 
 # Ingest and delete functions
-def _split_and_label(doc_path: str) -> list[Document]:
-    loader = TextLoader(doc_path, encoding="utf-8")
-    docs = loader.load()  # returns [Document(page_content=...)]
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n### ", "\n## ", "\n# ", "\n"],
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-    )
-    # Split and add source filename as metadata
-    split_docs = text_splitter.split_documents(docs)
-    for d in split_docs:
-        d.metadata = d.metadata or {}
-        d.metadata["source"] = os.path.basename(doc_path)
+def _split_fast(text: str, size: int, overlap: int) -> list[tuple[str, int]]:
+    """
+    Split text on headers/newlines in a single regex pass and greedily pack the
+    pieces into chunks of at most `size` tokens, carrying up to `overlap` tokens
+    of trailing pieces into the next chunk. A single piece longer than `size`
+    falls back to TEXT_SPLITTER.
+    Returns (chunk, overlap_chars) pairs, where the first overlap_chars characters
+    of a chunk repeat the end of the previous one (0 when nothing was carried).
+    """
+    parts = _SEP_RE.split(text)
+    # Keep each separator at the start of the piece that follows it
+    pieces = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2)]
+
+    chunks: list[tuple[str, int]] = []
+    current: deque[tuple[str, int]] = deque()
+    current_tokens = 0
+    carried_chars = 0  # length of the pieces at the front of `current` carried from the last chunk
+
+    def emit() -> None:
+        raw = "".join(piece for piece, _ in current)
+        chunk = raw.strip()
+        if chunk:
+            leading = len(raw) - len(raw.lstrip())
+            chunks.append((chunk, min(max(carried_chars - leading, 0), len(chunk))))
+
+    for piece in pieces:
+        if not piece:
+            continue
+        tokens = len(ENCODING.encode(piece))
+        if tokens > size:
+            emit()
+            current.clear()
+            current_tokens = 0
+            carried_chars = 0
+            # TEXT_SPLITTER's own overlap is not tracked, so these never have their overlap stripped
+            chunks.extend((chunk, 0) for chunk in TEXT_SPLITTER.split_text(piece))
+            continue
+        if current and current_tokens + tokens > size:
+            emit()
+            # Drop leading pieces until only the overlap remains and the new piece fits
+            while current and (current_tokens > overlap or current_tokens + tokens > size):
+                current_tokens -= current.popleft()[1]
+            carried_chars = sum(len(p) for p, _ in current)
+        current.append((piece, tokens))
+        current_tokens += tokens
+    emit()
+    return chunks
+
+def _split_and_label(doc_path: str, text: str) -> list[Document]:
+    # Split and add source path as metadata; content-hash ids make re-ingesting upsert in place
+    src = doc_source(doc_path)
+    split_docs = [
+        Document(page_content=chunk, metadata={"source": src}, id=chunk_id(src, i, chunk))
+        for i, chunk in enumerate(_merge_small_chunks(_split_fast(text, CHUNK_SIZE, CHUNK_OVERLAP)))
+    ]
     return split_docs
 
-def ingest_all():
-    """Ingest all .md files under DOCS_DIR, rebuilding the Chroma DB."""
-    md_paths = glob.glob(os.path.join(DOCS_DIR, "**", "*.md"), recursive=True)
-    all_chunks = []
-    for path in md_paths:
+def _merge_small_chunks(chunks: list[tuple[str, int]]) -> list[str]:
+    """
+    Merge tiny chunks (e.g. a lone header line) into their neighbour so they
+    don't take up a retrieval slot or an embedding on their own.
+    Expects (chunk, overlap_chars) pairs from _split_fast for a single document,
+    in order. The overlap a chunk carries is dropped when it merges into the
+    previous one, so it is not repeated.
+    """
+    merged: list[str] = []
+    merged_tokens: list[int] = []
+    for chunk, overlap in chunks:
+        tokens = len(ENCODING.encode(chunk))
+        if merged and (tokens < MIN_CHUNK_TOKENS or merged_tokens[-1] < MIN_CHUNK_TOKENS):
+            if overlap:
+                # The rest of the chunk starts with the separator that followed the overlap
+                text = merged[-1] + chunk[overlap:]
+            else:
+                text = merged[-1] + "\n" + chunk
+            text_tokens = len(ENCODING.encode(text))
+            if text_tokens <= MAX_MERGED_TOKENS:
+                merged[-1] = text
+                merged_tokens[-1] = text_tokens
+                continue
+        merged.append(chunk)
+        merged_tokens.append(tokens)
+    return merged
+
+def _write_batch(batch: list[Document], embeddings: list[list[float]]) -> None:
+    get_vectorstore()._collection.upsert(
+        ids=[c.id for c in batch],
+        embeddings=embeddings,
+        documents=[c.page_content for c in batch],
+        metadatas=[c.metadata for c in batch],
+    )
+
+async def _embed_and_store(chunks: list[Document]) -> None:
+    """
+    Embed chunks in batches with up to EMBED_CONCURRENCY requests in flight, then
+    write the precomputed vectors to Chroma so it does not embed them again.
+    Batches are started as earlier ones finish, across write-sized windows, and
+    each window is written as soon as its last batch is embedded, so only about
+    two windows of vectors are held at once.
+    """
+    # Similar-length texts per batch keep each request's token count balanced
+    chunks = sorted(chunks, key=lambda c: len(c.page_content))
+
+    async def embed(batch: list[Document]) -> list[list[float]]:
+        return await EMBEDDING_MODEL.aembed_documents([c.page_content for c in batch])
+
+    # Few large writes: Chroma commits (and fsyncs) once per add() call
+    write_size = min(WRITE_BATCH_SIZE, get_vectorstore()._client.get_max_batch_size())
+    windows = [chunks[i:i + write_size] for i in range(0, len(chunks), write_size)]
+    # (window index, batch), cut per window so no batch spans two windows
+    batches = iter([
+        (w, window[j:j + EMBED_BATCH_SIZE])
+        for w, window in enumerate(windows)
+        for j in range(0, len(window), EMBED_BATCH_SIZE)
+    ])
+    in_flight: deque[tuple[int, asyncio.Task]] = deque()
+
+    def top_up() -> None:
+        for w, batch in itertools.islice(batches, EMBED_CONCURRENCY - len(in_flight)):
+            in_flight.append((w, asyncio.create_task(embed(batch))))
+
+    pending_write: asyncio.Task | None = None
+    embeddings: list[list[float]] = []
+    try:
+        top_up()
+        while in_flight:
+            w, task = in_flight.popleft()
+            embeddings.extend(await task)
+            top_up()
+            if in_flight and in_flight[0][0] == w:
+                continue
+            # That was the window's last batch: hand it to the writer, one write at a time
+            if pending_write is not None:
+                await pending_write
+            pending_write = asyncio.create_task(asyncio.to_thread(_write_batch, windows[w], embeddings))
+            embeddings = []
+    finally:
+        # On failure, stop the remaining requests and collect their results so none go unretrieved
+        for _, task in in_flight:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+        # A write already running in its thread cannot be interrupted, so always wait for it
+        if pending_write is not None:
+            await pending_write
+
+def _unstored(chunks: list[Document]) -> list[Document]:
+    """Chunks whose id is not in the store yet; the rest are unchanged and need no embedding."""
+    vectorstore = get_vectorstore()
+    batch_size = vectorstore._client.get_max_batch_size()
+    stored: set[str] = set()
+    for i in range(0, len(chunks), batch_size):
+        ids = [c.id for c in chunks[i:i + batch_size]]
+        stored.update(vectorstore.get(ids=ids, include=[])["ids"])
+    return [c for c in chunks if c.id not in stored]
+
+async def _store(chunks: list[Document]) -> None:
+    """Embed and write the new chunks, then drop the chunks their files no longer produce."""
+    new_chunks = await asyncio.to_thread(_unstored, chunks)
+    await _embed_and_store(new_chunks)
+    sources = sorted({c.metadata["source"] for c in chunks})
+    await asyncio.to_thread(delete_stale, get_vectorstore(), sources, {c.id for c in chunks})
+
+async def _aread(path: str, semaphore: asyncio.Semaphore) -> str | None:
+    async with semaphore:
         try:
-            all_chunks.extend(_split_and_label(path))
+            async with aiofiles.open(path, "r", encoding="utf-8") as f:
+                return await f.read()
         except Exception as e:
-            print(f"Error loading file {path}: {e}")
+            log.warning(f"Error loading file {path}: {e}")
+            return None
+
+def _try_split_and_label(path: str, text: str) -> list[Document]:
+    try:
+        return _split_and_label(path, text)
+    except Exception as e:
+        log.warning(f"Error splitting file {path}: {e}")
+        return []
+
+def _split_all(paths: list[str], texts: list[str]) -> list[Document]:
+    all_chunks = []
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for chunks in executor.map(_try_split_and_label, paths, texts):
+            all_chunks.extend(chunks)
+    return all_chunks
+
+async def _load_all(md_paths: list[str]) -> list[Document]:
+    """Read files concurrently without blocking the event loop, then split them on a thread pool."""
+    semaphore = asyncio.Semaphore(READ_CONCURRENCY)
+    texts = await asyncio.gather(*[_aread(path, semaphore) for path in md_paths])
+    loaded = [(path, text) for path, text in zip(md_paths, texts) if text is not None]
+    if not loaded:
+        return []
+    paths, texts = zip(*loaded)
+    return await asyncio.to_thread(_split_all, list(paths), list(texts))
+
+async def ingest_all():
+    """Ingest all .md files under DOCS_DIR, rebuilding the Chroma DB."""
+    md_paths = glob.glob(os.path.join(DOCS_DIR, "**", "*.md"), recursive=True)
+    all_chunks = await _load_all(md_paths)
     if not all_chunks:
-        print("No markdown files found!")
+        log.warning("No markdown files found!")
         return
-    # Overwrite DB with new content
-    vectorstore = Chroma.from_documents(
-        documents=all_chunks,
-        embedding=EMBEDDING_MODEL,
-        persist_directory=CHROMA_DIR
-    )
-    print(f"✅ Ingested {len(all_chunks)} chunks from {len(md_paths)} files.")
+    await _store(all_chunks)
+    log.info(f"✅ Ingested {len(all_chunks)} chunks from {len(md_paths)} files.")
 
-def ingest(doc_names: list[str]) -> int:
-    """Ingest just the specified docs into Chroma DB (additive, does not delete).
-    Returns number of chunks ingested.
-    Raises FileNotFoundError if none found.
-    """
-    chunks = []
+async def _load_named(doc_names: list[str]) -> list[Document]:
+    paths = []
     for doc_name in doc_names:
         path = os.path.join(DOCS_DIR, doc_name)
         if not os.path.isfile(path):
-            print(f"File not found: {path}")
+            log.warning(f"File not found: {path}")
             continue
-        try:
-            chunks.extend(_split_and_label(path))
-        except Exception as e:
-            print(f"Error loading {path}: {e}")
+        paths.append(path)
+    return await _load_all(paths)
+
+async def ingest(doc_names: list[str]) -> int:
+    """Ingest just the specified docs into Chroma DB, replacing their stored chunks;
+    other docs are left alone.
+    Returns number of chunks ingested.
+    Raises FileNotFoundError if none found.
+    """
+    chunks = await _load_named(doc_names)
     if not chunks:
-        print("No valid files to ingest.")
+        log.warning("No valid files to ingest.")
         raise FileNotFoundError("No valid files to ingest.")
-    # Append to existing vectorstore
-    vectorstore = Chroma(
-        persist_directory=CHROMA_DIR,
-        embedding_function=EMBEDDING_MODEL
-    )
-    vectorstore.add_documents(chunks)
-    print(f"✅ Ingested {len(chunks)} chunks from {len(doc_names)} docs.")
+    # Update these docs in the existing vectorstore
+    await _store(chunks)
+    log.info(f"✅ Ingested {len(chunks)} chunks from {len(doc_names)} docs.")
     return len(chunks)
 
 def delete_docs(doc_names: List[str]) -> Dict[str, int]:
@@ -112,16 +319,19 @@ def delete_docs(doc_names: List[str]) -> Dict[str, int]:
     Delete all chunks in the DB that have a source in doc_names.
     Returns: dict mapping doc_name to number of deleted chunks.
     """
-    vectorstore = Chroma(
-        persist_directory=CHROMA_DIR,
-        embedding_function=EMBEDDING_MODEL
-    )
+    if not doc_names:
+        return {}
+    # One filtered lookup for all docs instead of listing every id before and after each delete
+    vectorstore = get_vectorstore()
+    matching = vectorstore.get(where={"source": {"$in": list(doc_names)}}, include=["metadatas"])
+    # Delete in slices: one call with every id can exceed SQLite's bound-variable limit
+    ids = matching["ids"]
+    delete_size = vectorstore._client.get_max_batch_size()
+    for i in range(0, len(ids), delete_size):
+        vectorstore.delete(ids=ids[i:i + delete_size])
+    counts = Counter(md.get("source") for md in matching["metadatas"])
     deleted_counts = {}
     for doc_name in doc_names:
-        n_before = len(vectorstore.get()['ids'])
-        vectorstore.delete(where={"source": doc_name})
-        n_after = len(vectorstore.get()['ids'])
-        deleted = n_before - n_after
-        deleted_counts[doc_name] = deleted
-        print(f"✅ Deleted {deleted} chunks from {doc_name}.")
+        deleted_counts[doc_name] = counts.get(doc_name, 0)
+        log.info(f"✅ Deleted {deleted_counts[doc_name]} chunks from {doc_name}.")
     return deleted_counts
@@ -0,0 +1,5 @@
+import os
+
+# The modules under test refuse to import without these keys; the tests never call the APIs
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("SERPAPI_API_KEY", "test-key")
@@ -0,0 +1,58 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+import agent_with_custom_history as agent
+
+
+def turn(i: int) -> list:
+    return [HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")]
+
+
+def test_evict_compacts_in_blocks():
+    memory = agent.ConversationSummaryBufferMessageHistory(llm=agent.llm, k=6)
+    for i in range(3):
+        assert memory._evict(turn(i)) is None
+    assert len(memory.messages) == 6
+
+    # Going over k compacts down to k // 2 and asks for a summary of the rest
+    assert memory._evict(turn(3)) is not None
+    assert len(memory.messages) == 3
+    kept = list(memory.messages)
+
+    # Between compactions the history only grows, so its head stays the same
+    assert memory._evict(turn(4)) is None
+    assert memory.messages[:3] == kept
+
+
+def test_evict_respects_token_budget():
+    memory = agent.ConversationSummaryBufferMessageHistory(llm=agent.llm, k=100, token_budget=50)
+    assert memory._evict([HumanMessage(content="word " * 60)]) is not None
+    assert memory.messages == []
+
+
+def test_call_tool_deduped_shares_calls_until_invalidated(monkeypatch):
+    calls = []
+
+    async def fake_tool(query: str) -> str:
+        calls.append(query)
+        await asyncio.sleep(0)
+        return f"result for {query}"
+
+    monkeypatch.setitem(agent.name2tool, "fake_tool", fake_tool)
+    agent.invalidate_tool_results()
+
+    async def run():
+        concurrent = await asyncio.gather(
+            agent.call_tool_deduped("fake_tool", {"query": "q"}),
+            agent.call_tool_deduped("fake_tool", {"query": "q"}),
+        )
+        cached = await agent.call_tool_deduped("fake_tool", {"query": "q"})
+        agent.invalidate_tool_results()
+        fresh = await agent.call_tool_deduped("fake_tool", {"query": "q"})
+        return concurrent, cached, fresh
+
+    concurrent, cached, fresh = asyncio.run(run())
+    assert concurrent == ["result for q", "result for q"]
+    assert cached == fresh == "result for q"
+    assert calls == ["q", "q"]
@@ -0,0 +1,20 @@
+import main
+
+
+def test_get_summary_never_serves_a_scan_that_overlapped_an_invalidation(monkeypatch):
+    scans = []
+
+    def fake_summarize_chroma():
+        scans.append(len(scans) + 1)
+        if len(scans) == 1:
+            # The store changes while the first scan is running
+            main.invalidate_summary()
+        return [{"source": "a.md", "count": scans[-1]}]
+
+    monkeypatch.setattr(main, "summarize_chroma", fake_summarize_chroma)
+    main.invalidate_summary()
+
+    assert main.get_summary() == {"a.md": 1}
+    assert main.get_summary() == {"a.md": 2}
+    assert main.get_summary() == {"a.md": 2}
+    assert scans == [1, 2]
@@ -0,0 +1,69 @@
+import glob
+
+import pytest
+
+from rag_manager import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    ENCODING,
+    MAX_MERGED_TOKENS,
+    _merge_small_chunks,
+    _split_fast,
+)
+
+
+def tokens(text: str) -> int:
+    return len(ENCODING.encode(text))
+
+
+def test_split_falls_back_for_a_line_longer_than_size():
+    long_line = "word " * (3 * CHUNK_SIZE)
+    chunks = _split_fast("intro line\n" + long_line + "\noutro line", CHUNK_SIZE, CHUNK_OVERLAP)
+    assert chunks[0] == ("intro line", 0)
+    assert chunks[-1] == ("outro line", 0)
+    middle = chunks[1:-1]
+    assert len(middle) > 1
+    # TEXT_SPLITTER's chunks are kept as-is, with no tracked overlap
+    assert all(overlap == 0 for _, overlap in middle)
+    assert all(tokens(chunk) <= CHUNK_SIZE for chunk, _ in middle)
+
+
+def test_split_carries_trailing_lines_as_overlap():
+    lines = [f"line {i}: " + " ".join(["alpha"] * 25) for i in range(12)]
+    chunks = _split_fast("\n".join(lines), 100, 40)
+    assert len(chunks) > 1
+    assert chunks[0][1] == 0
+    for (prev, _), (chunk, overlap) in zip(chunks, chunks[1:]):
+        assert overlap > 0
+        assert prev.endswith(chunk[:overlap])
+        assert tokens(chunk[:overlap]) <= 40
+
+
+def test_split_carries_no_overlap_when_the_last_line_is_too_long():
+    lines = ["short", "x " * 60, "y " * 60]
+    chunks = _split_fast("\n".join(lines), 100, 40)
+    assert [overlap for _, overlap in chunks] == [0, 0]
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob("docs/*.md")))
+def test_chunks_stay_under_size_limits(path):
+    with open(path, encoding="utf-8") as f:
+        chunks = _split_fast(f.read(), CHUNK_SIZE, CHUNK_OVERLAP)
+    assert all(tokens(chunk) <= CHUNK_SIZE for chunk, _ in chunks)
+    assert all(tokens(chunk) <= MAX_MERGED_TOKENS for chunk in _merge_small_chunks(chunks))
+
+
+def test_merge_drops_carried_overlap():
+    chunks = [("# Title\nalpha beta", 0), ("alpha beta\ngamma delta", 10)]
+    assert _merge_small_chunks(chunks) == ["# Title\nalpha beta\ngamma delta"]
+
+
+def test_merge_keeps_text_when_nothing_was_carried():
+    # Neighbours that merely share a word at the seam do not overlap
+    chunks = [("Intro paragraph ends with Python", 0), ("Python is a language", 0)]
+    assert _merge_small_chunks(chunks) == ["Intro paragraph ends with Python\nPython is a language"]
+
+
+def test_merge_keeps_closing_brace_without_overlap():
+    chunks = [("void f() {\n    foo();\n}", 0), ("}\n\nclass Bar {", 0)]
+    assert _merge_small_chunks(chunks) == ["void f() {\n    foo();\n}\n}\n\nclass Bar {"]
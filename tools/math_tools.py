@@ -2,24 +2,45 @@ from langchain_core.tools import tool
 import math
 import asyncio
 import logging
+from functools import lru_cache
+from types import MappingProxyType
+
+# Names an expression may reference; built once at import and read-only, so an
+# assignment inside an expression (e.g. `(pi := 4)`) raises instead of changing it
+ALLOWED_NAMES = MappingProxyType({
+    **{k: v for k, v in math.__dict__.items() if not k.startswith("__")},
+    "abs": abs,
+    "round": round,
+})
+# Expressions longer than this are evaluated in a worker thread instead of on the event loop
+OFFLOAD_EXPR_LEN = 500
+
+@lru_cache(maxsize=1024)
+def _compile(expr: str):
+    """Compile and validate an expression once; repeated expressions hit the cache."""
+    code = compile(expr, "<string>", "eval")
+    for name in code.co_names:
+        if name not in ALLOWED_NAMES:
+            raise NameError(f"Use of '{name}' not allowed in math expressions.")
+    return code
 
 @tool
-async def add(x: float, y: float) -> float:
+def add(x: float, y: float) -> float:
     """Add 'x' and 'y'."""
     return x + y
 
 @tool
-async def multiply(x: float, y: float) -> float:
+def multiply(x: float, y: float) -> float:
     """Multiply 'x' and 'y'."""
     return x * y
 
 @tool
-async def exponentiate(x: float, y: float) -> float:
+def exponentiate(x: float, y: float) -> float:
     """Raise 'x' to the power of 'y'."""
     return x ** y
 
 @tool
-async def subtract(x: float, y: float) -> float:
+def subtract(x: float, y: float) -> float:
     """Subtract 'x' from 'y'."""
     return y - x
 
@@ -31,20 +52,17 @@ async def evaluate_expression(expr: str) -> float:
     Do not remove or rearrange any part of the expression. For example,
     if the user asks what is (3 - 5) / 6 + 8, call this tool with expr="(3 - 5) / 6 + 8".
     """
-    allowed_names = {k: v for k, v in math.__dict__.items() if not k.startswith("__")}
-    allowed_names.update({"abs": abs, "round": round})
 
     def safe_eval():
         try:
-            code = compile(expr, "<string>", "eval")
-            for name in code.co_names:
-                if name not in allowed_names:
-                    raise NameError(f"Use of '{name}' not allowed in math expressions.")
-            result = eval(code, {"__builtins__": {}}, allowed_names)
+            result = eval(_compile(expr), {"__builtins__": {}}, ALLOWED_NAMES)
             return float(result)
         except Exception as e:
             # Print for backend logs and return as string for LLM response
             logging.error(f"Error evaluating expression '{expr}': {e}")
             return f"Error: {e}"
 
-    return await asyncio.get_event_loop().run_in_executor(None, safe_eval)
+    # Typical expressions evaluate in microseconds, less than a thread-pool hop costs
+    if len(expr) > OFFLOAD_EXPR_LEN:
+        return await asyncio.to_thread(safe_eval)
+    return safe_eval()
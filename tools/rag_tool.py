@@ -1,13 +1,32 @@
 # tools/rag_tool.py
 
+import asyncio
+from functools import lru_cache
 from typing import List, Tuple, Union
 from langchain.tools import tool
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
 
+from cached_embeddings import CachedEmbeddings
+
 import logging
 
+CHROMA_DIR = "chroma_db"
+K = 3 # Number of chunks to return
+THRESHOLD = 0.7 # Minimum score threshold for relevance
+
+# Shared across calls so each query reuses one embeddings client and one Chroma handle
+_EMBEDDINGS = CachedEmbeddings(OpenAIEmbeddings())
+
+@lru_cache(maxsize=None)
+def get_vectorstore() -> Chroma:
+    """Open the Chroma handle on first use, so importing this module does not create CHROMA_DIR."""
+    return Chroma(
+        persist_directory=CHROMA_DIR,
+        embedding_function=_EMBEDDINGS
+    )
+
 def build_filter(source):
     if isinstance(source, list) and source:
         return {"source": {"$in": source}}
@@ -26,54 +45,51 @@ async def retrieval_tool(query: str, source: str = None) -> str:
     Use this tool for ANY question about Python, programming, or technical topics.
     """
 
-    CHROMA_DIR = "chroma_db"
-    EMBEDDING_MODEL = OpenAIEmbeddings()
-    K = 3 # Number of chunks to return
-    THRESHOLD = 0.7 # Minimum score threshold for relevance
-
     # Filter by source if provided
     filter_val = build_filter(source)
 
-    vectorstore = Chroma(
-        persist_directory=CHROMA_DIR,
-        embedding_function=EMBEDDING_MODEL
-    )
     logging.info(f"Filter used in retrieval_tool: {filter_val}")
 
-    results: List[Tuple[Union[Document, str], float]] = vectorstore.similarity_search_with_relevance_scores(
-        query,
+    # Embed once (served from the LRU for repeated questions) and search by vector.
+    # The by-vector search returns raw distances, so map them to relevance scores
+    # the same way similarity_search_with_relevance_scores does.
+    # The Chroma client is synchronous, so run the search in a worker thread
+    # to keep the event loop free for other sessions' streams.
+    vec = await _EMBEDDINGS.aembed_query(query)
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    relevance_score_fn = vectorstore._select_relevance_score_fn()
+    hits = await asyncio.to_thread(
+        vectorstore.similarity_search_by_vector_with_relevance_scores,
+        vec,
         k=K,
         filter=filter_val,
     )
-
-    for i, (chunk_obj, score) in enumerate(results):
-        text = chunk_obj.page_content if isinstance(chunk_obj, Document) else str(chunk_obj)
-        # Print the first 80 characters so you can see what chunk we’re talking about
-        src = getattr(chunk_obj, "metadata", {}).get("source", "unknown")
-        snippet = text.replace("\n", " ")[:80] + "…"
-        logging.info(f"Candidate #{i+1}: source={src} score = {score:.3f}, text starts with -> {snippet}")
+    results: List[Tuple[Union[Document, str], float]] = [
+        (doc, relevance_score_fn(distance)) for doc, distance in hits
+    ]
 
     # If nothing is in the index, return fallback immediately
     if not results:
         return "No relevant documents found."
 
-    # ─── Step 3: Check top‐score vs. threshold ──────────────────────────────────
+    # ─── Step 3: Check scores vs. threshold ─────────────────────────────────────
+    # Results come back best-first, so the first chunk below threshold ends the scan.
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
     top_texts: List[str] = []
-    i = 0
-    for chunk_obj, score in results:
-        i += 1
+    for i, (chunk_obj, score) in enumerate(results, start=1):
+        text = chunk_obj.page_content if isinstance(chunk_obj, Document) else str(chunk_obj)
+        if debug:
+            # Log the first 80 characters so you can see what chunk we’re talking about
+            src = getattr(chunk_obj, "metadata", {}).get("source", "unknown")
+            snippet = text.replace("\n", " ")[:80] + "…"
+            logging.debug(f"Candidate #{i}: source={src} score = {score:.3f}, text starts with -> {snippet}")
         if score < THRESHOLD:
-            # Skip any chunk scoring below threshold
-            logging.info(f"Candidate#{i}: score = {score:.3f}, Skipping (below threshold {THRESHOLD})")
-            continue
-
-        if isinstance(chunk_obj, Document):
-            top_texts.append(chunk_obj.page_content)
-        else:
-            top_texts.append(str(chunk_obj))
+            logging.info(f"Candidate#{i}: score = {score:.3f}, Skipping it and the rest (below threshold {THRESHOLD})")
+            break
+        top_texts.append(text)
 
     if not top_texts:
         # If ALL candidates fell below threshold, fall back
         return "No relevant documents found."
 
-    return "\n\n---NEXT-CHUNK---\n\n".join(top_texts).join(f"Retrieving documents for query: {query}")
+    return f"Retrieving documents for query: {query}\n\n" + "\n\n---NEXT-CHUNK---\n\n".join(top_texts)
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import aiohttp
+import orjson
 from pydantic import BaseModel, SecretStr
 from langchain_core.tools import tool
 
@@ -11,7 +13,8 @@ class Article(BaseModel):
 
     @classmethod
     def from_serpapi_result(cls, result: dict) -> "Article":
-        return cls(
+        # SerpAPI fields are already strings; skip validation on this hot path
+        return cls.model_construct(
             title=result["title"],
             source=result["source"],
             link=result["link"],
@@ -20,6 +23,27 @@ class Article(BaseModel):
 
 SERPAPI_API_KEY = SecretStr(os.environ["SERPAPI_API_KEY"])
 
+# One pooled session for all searches, so keep-alive connections and TLS sessions are reused
+_SESSION: aiohttp.ClientSession | None = None
+_SESSION_LOCK = asyncio.Lock()
+
+async def _get_session() -> aiohttp.ClientSession:
+    global _SESSION
+    async with _SESSION_LOCK:
+        if _SESSION is None or _SESSION.closed:
+            _SESSION = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+        return _SESSION
+
+async def close_session() -> None:
+    """Close the shared session; call on application shutdown."""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
 @tool
 async def serpapi(query: str) -> list[Article]:
     """Use this tool to search the web."""
@@ -28,10 +52,10 @@ async def serpapi(query: str) -> list[Article]:
         "engine": "google",
         "q": query,
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://serpapi.com/search",
-            params=params
-        ) as response:
-            results = await response.json()
+    session = await _get_session()
+    async with session.get(
+        "https://serpapi.com/search",
+        params=params
+    ) as response:
+        results = orjson.loads(await response.read())
     return [Article.from_serpapi_result(result) for result in results["organic_results"]]
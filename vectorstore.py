@@ -1,6 +1,7 @@
 # vectorstore.py
 
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # ─── Step 1: Imports ────────────────────────────────────────────────────────────
@@ -11,6 +12,9 @@ from langchain_chroma import Chroma
 # We continue to use `OpenAIEmbeddings` from `langchain_openai`
 from langchain_openai import OpenAIEmbeddings
 
+# Query-embedding LRU, also used by the retrieval tool
+from cached_embeddings import CachedEmbeddings
+
 
 # ─── Step 2: Load environment variables ──────────────────────────────────────────
 
@@ -23,14 +27,17 @@ if not openai_key:
 # ─── Step 3: Instantiate the Embedding Model ─────────────────────────────────────
 
 # Use the same embeddings class you used during ingestion so that vectors align.
-embeddings = OpenAIEmbeddings()
+# Query embeddings are memoized, so repeated questions skip the API call.
+embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
 
 # ─── Step 4: Function to Load Chroma Vector Store ────────────────────────────────
 
+@lru_cache(maxsize=None)
 def load_vectorstore(persist_dir: str = "chroma_db"):
     """
     Load an existing Chroma vector store from disk and return a Retriever.
+    The retriever is memoized per directory, so repeated queries reuse one client.
     Raises:
         FileNotFoundError: if the directory does not exist.
     """
@@ -65,9 +72,10 @@ def query_chroma(question: str, k: int = 3):
     """
     retriever = load_vectorstore()
 
-    # Instead of `get_relevant_documents(...)`, use `invoke(...)` (or `__call__`)
-    docs = retriever.invoke(question)
+    # Embed the question once (cached) and search by vector, so Chroma does not
+    # embed it again; asking for k directly also lifts the retriever's default cap of 4.
+    vec = embeddings.embed_query(question)
+    docs = retriever.vectorstore.similarity_search_by_vector(vec, k=k)
 
-    # If you want only k results, slice the returned list:
-    top_chunks = [doc.page_content for doc in docs[:k]]
+    top_chunks = [doc.page_content for doc in docs]
     return top_chunks